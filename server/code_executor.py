@@ -3,27 +3,41 @@ Sandboxed Python code execution engine.
 
 Security model:
 - AST validation: whitelist imports, block dangerous builtins/attributes
-- subprocess isolation: 30s timeout, stdin closed, stdout/stderr capped
+- subprocess isolation: pool of long-lived workers, 30s timeout per job
 - Temp directory: each execution gets its own isolated directory
 - Network: allowed (yfinance needs it), but server-side modules blocked
+
+Execution uses a pool of persistent worker processes (worker.py) that
+pre-import the heavy scientific stack once at spawn, so per-call latency
+is just the exec of the user code instead of interpreter startup plus
+numpy/pandas/matplotlib import cost.
 """
 
 import ast
+import asyncio
+import hashlib
+import json
 import logging
 import os
+import re
 import shutil
+import struct
 import subprocess
 import sys
-import tempfile
 import time
+import unicodedata
 import uuid
+from collections import OrderedDict
+
+import orjson
 
 logger = logging.getLogger(__name__)
 
 OUTPUT_BASE_DIR = os.path.join(os.path.dirname(__file__), "code_output")
 
-# Modules the LLM is allowed to import
-ALLOWED_MODULES = {
+# Modules the LLM is allowed to import. Frozen: the policy sets are
+# queried per AST node and must never be mutated at runtime.
+ALLOWED_MODULES = frozenset({
     # Math & science
     "math", "cmath", "decimal", "fractions", "statistics", "random",
     # Data
@@ -49,90 +63,388 @@ ALLOWED_MODULES = {
     "typing", "dataclasses", "enum", "abc",
     "io", "base64", "hashlib", "hmac",
     "time", "calendar",
-}
+})
 
 # Builtins that must never be called
-BLOCKED_BUILTINS = {
+BLOCKED_BUILTINS = frozenset({
     "exec", "eval", "compile", "__import__", "globals", "locals",
     "getattr", "setattr", "delattr", "vars",
     "open",  # no file I/O
     "input",  # no stdin
     "breakpoint",
     "exit", "quit",
-}
+})
 
 # Dunder attributes that indicate introspection / escape attempts
-BLOCKED_DUNDERS = {
+BLOCKED_DUNDERS = frozenset({
     "__subclasses__", "__bases__", "__mro__", "__class__",
     "__globals__", "__code__", "__builtins__",
     "__import__", "__loader__", "__spec__",
-}
+})
 
+# Top-level names of the allowed modules, so dotted-import checks don't
+# re-split the allowlist on every visit
+_ALLOWED_TOPLEVEL = frozenset(m.split(".")[0] for m in ALLOWED_MODULES)
 
-class CodeValidator(ast.NodeVisitor):
-    """Walk AST to enforce the security policy."""
 
-    def __init__(self):
-        self.errors: list[str] = []
+# Fast-path scan: every construct the validator can reject requires one
+# of these textual markers — the `import` keyword, a dunder attribute, or
+# a blocked builtin name. If none appear, the AST walk can be skipped.
+# The scan must run against an NFKC-normalized copy of the source:
+# Python normalizes identifiers at parse time, so e.g. fullwidth
+# "ｅｖａｌ" parses to Name(id='eval') while the raw text matches nothing.
+_SUSPECT_RE = re.compile(
+    r"\bimport\b|__\w+__|\b(?:" + "|".join(map(re.escape, sorted(BLOCKED_BUILTINS))) + r")\b"
+)
 
-    def visit_Import(self, node: ast.Import):
-        for alias in node.names:
-            self._check_module(alias.name, node.lineno)
-        self.generic_visit(node)
 
-    def visit_ImportFrom(self, node: ast.ImportFrom):
-        if node.module:
-            self._check_module(node.module, node.lineno)
-        self.generic_visit(node)
+# The allowed-modules listing in rejection messages never changes;
+# sorting and joining it per rejected import is wasted work
+_ALLOWED_MODULES_STR = ", ".join(sorted(ALLOWED_MODULES))
 
-    def _check_module(self, module_name: str, lineno: int):
-        # Allow exact match or parent package match
-        top = module_name.split(".")[0]
-        if module_name not in ALLOWED_MODULES and top not in ALLOWED_MODULES:
-            self.errors.append(
-                f"Line {lineno}: import of '{module_name}' is not allowed. "
-                f"Allowed modules: {', '.join(sorted(ALLOWED_MODULES))}"
-            )
 
-    def visit_Call(self, node: ast.Call):
-        # Block dangerous builtin calls
-        if isinstance(node.func, ast.Name) and node.func.id in BLOCKED_BUILTINS:
-            self.errors.append(
-                f"Line {node.lineno}: call to '{node.func.id}()' is not allowed."
-            )
-        self.generic_visit(node)
+def _check_module(module_name: str, lineno: int, errors: list[str]):
+    # Allow exact match or parent package match
+    if module_name not in ALLOWED_MODULES and module_name.split(".")[0] not in _ALLOWED_TOPLEVEL:
+        errors.append(
+            f"Line {lineno}: import of '{module_name}' is not allowed. "
+            f"Allowed modules: {_ALLOWED_MODULES_STR}"
+        )
 
-    def visit_Attribute(self, node: ast.Attribute):
-        if node.attr in BLOCKED_DUNDERS:
-            self.errors.append(
-                f"Line {node.lineno}: access to '{node.attr}' is not allowed."
-            )
-        self.generic_visit(node)
 
+def _scan_tree(tree: ast.AST) -> list[str]:
+    """Enforce the security policy in a single flat walk of the AST.
 
-def validate_code(code: str) -> tuple[bool, list[str]]:
-    """Parse and validate code. Returns (is_valid, error_list)."""
+    One ast.walk with inlined isinstance checks, rather than NodeVisitor's
+    per-node method dispatch and recursive generic_visit.
+    """
+    errors: list[str] = []
+    # Hoist globals into locals: LOAD_FAST instead of a dict lookup per
+    # node for the names touched on every iteration
+    attribute = ast.Attribute
+    call = ast.Call
+    name = ast.Name
+    import_ = ast.Import
+    import_from = ast.ImportFrom
+    blocked_dunders = BLOCKED_DUNDERS
+    blocked_builtins = BLOCKED_BUILTINS
+    for node in ast.walk(tree):
+        if isinstance(node, attribute):
+            if node.attr in blocked_dunders:
+                errors.append(
+                    f"Line {node.lineno}: access to '{node.attr}' is not allowed."
+                )
+        elif isinstance(node, call):
+            # Block dangerous builtin calls
+            if isinstance(node.func, name) and node.func.id in blocked_builtins:
+                errors.append(
+                    f"Line {node.lineno}: call to '{node.func.id}()' is not allowed."
+                )
+        elif isinstance(node, import_):
+            for alias in node.names:
+                _check_module(alias.name, node.lineno, errors)
+        elif isinstance(node, import_from):
+            if node.module:
+                _check_module(node.module, node.lineno, errors)
+    return errors
+
+
+def _code_digest(code: str) -> bytes:
+    """16-byte blake2b digest of a snippet — the one hash every cache
+    layer (validation memo, disk verdicts, result cache) keys on.
+
+    blake2b with a truncated digest is the fastest hash in hashlib for
+    short inputs; xxhash/blake3 would shave little more for a new
+    dependency.
+    """
+    return hashlib.blake2b(code.encode(), digest_size=16).digest()
+
+
+# Validation results memoized by source digest. The LLM frequently
+# retries identical code, so repeats skip the parse + walk entirely;
+# keying by a 16-byte digest (instead of lru_cache on the string itself)
+# means the cache never pins hundreds of full source snippets in memory.
+_VALIDATE_CACHE_SIZE = 512
+_validate_cache: OrderedDict[bytes, tuple[bool, tuple[str, ...]]] = OrderedDict()
+
+# Validation results also persist across restarts in a small JSON file
+# (the in-memory LRU dies with the process). Loaded once at import; new
+# verdicts are written through with an atomic replace. A verdict is only
+# pure in the source *under a fixed policy*, so the file carries a digest
+# of the policy sets: any whitelist/blocklist change (or validator fix)
+# orphans every persisted verdict instead of letting it outlive the
+# tightening.
+_DISK_VALIDATE_CACHE_PATH = os.path.join(
+    os.path.dirname(__file__), ".validate_cache.json"
+)
+_DISK_VALIDATE_CACHE_SIZE = 512
+
+_POLICY_DIGEST = hashlib.blake2b(
+    repr((
+        sorted(ALLOWED_MODULES),
+        sorted(BLOCKED_BUILTINS),
+        sorted(BLOCKED_DUNDERS),
+    )).encode(),
+    digest_size=16,
+).hexdigest()
+
+
+def _load_disk_validate_cache() -> dict[str, tuple[bool, tuple[str, ...]]]:
+    try:
+        with open(_DISK_VALIDATE_CACHE_PATH, encoding="utf-8") as f:
+            raw = json.load(f)
+        if raw.get("policy") != _POLICY_DIGEST:
+            return {}
+        return {
+            k: (bool(ok), tuple(errs))
+            for k, (ok, errs) in raw["entries"].items()
+        }
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+_disk_validate_cache = _load_disk_validate_cache()
+
+
+def _snapshot_validate_entries() -> dict:
+    return {k: [ok, list(errs)] for k, (ok, errs) in _disk_validate_cache.items()}
+
+
+def _write_disk_validate_cache(entries: dict):
+    try:
+        tmp = f"{_DISK_VALIDATE_CACHE_PATH}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"policy": _POLICY_DIGEST, "entries": entries}, f)
+        os.replace(tmp, _DISK_VALIDATE_CACHE_PATH)
+    except OSError as e:
+        logger.debug(f"Validation cache write failed: {e}")
+
+
+def _schedule_disk_validate_save():
+    """Write the cache off-loop when called from async code.
+
+    validate_code runs on the event loop (via execute_code); the JSON
+    rewrite must not block it. The entries are snapshotted here, before
+    handing off — concurrent validations mutate the dict, and iterating
+    it from the executor thread would race. Outside a loop (tests,
+    scripts) the write happens inline.
+    """
+    entries = _snapshot_validate_entries()
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _write_disk_validate_cache(entries)
+    else:
+        loop.run_in_executor(None, _write_disk_validate_cache, entries)
+
+
+def _validate_uncached(code: str) -> tuple[bool, tuple[str, ...]]:
+    """Parse and walk the AST once per distinct snippet.
+
+    Errors are returned as a tuple so cached entries stay immutable.
+    """
     try:
         tree = ast.parse(code)
     except SyntaxError as e:
-        return False, [f"Syntax error: {e}"]
+        return False, (f"Syntax error: {e}",)
+
+    # Skip the tree walk entirely when no suspect marker appears in the
+    # NFKC-normalized source — the same normalization the parser applies
+    # to identifiers (the parse above is still needed for syntax errors)
+    if not _SUSPECT_RE.search(unicodedata.normalize("NFKC", code)):
+        return True, ()
+
+    errors = _scan_tree(tree)
+    if errors:
+        return False, tuple(errors)
+    return True, ()
 
-    validator = CodeValidator()
-    validator.visit(tree)
 
-    if validator.errors:
-        return False, validator.errors
-    return True, []
+def validate_code(code: str) -> tuple[bool, list[str]]:
+    """Parse and validate code. Returns (is_valid, error_list)."""
+    key = _code_digest(code)
+    cached = _validate_cache.get(key)
+    if cached is None:
+        # Memory miss — try the persisted verdicts before validating
+        hexkey = key.hex()
+        cached = _disk_validate_cache.get(hexkey)
+        if cached is None:
+            cached = _validate_uncached(code)
+            _disk_validate_cache[hexkey] = cached
+            while len(_disk_validate_cache) > _DISK_VALIDATE_CACHE_SIZE:
+                del _disk_validate_cache[next(iter(_disk_validate_cache))]
+            _schedule_disk_validate_save()
+        _validate_cache[key] = cached
+        if len(_validate_cache) > _VALIDATE_CACHE_SIZE:
+            _validate_cache.popitem(last=False)
+    else:
+        _validate_cache.move_to_end(key)
+    is_valid, errors = cached
+    return is_valid, list(errors)
 
 
 # Max output sizes
 MAX_STDOUT = 50_000   # 50 KB
 MAX_STDERR = 10_000   # 10 KB
 
+# Per-job wall-clock timeout, and the canonical message reported for it
+EXECUTION_TIMEOUT = 30.0
+_TIMEOUT_MESSAGE = f"Execution timed out after {EXECUTION_TIMEOUT:.0f} seconds."
 
-def execute_code(code: str) -> dict:
+# Result cache for repeated snippets (the LLM often re-runs the exact
+# same code within a conversation). Only successful, image-free results
+# are cached, and only when the code shows no sign of nondeterminism —
+# anything touching randomness, clocks, or the network must re-run.
+_RESULT_CACHE_SIZE = 128
+_result_cache: OrderedDict[bytes, dict] = OrderedDict()
+
+_NONDETERMINISTIC_RE = re.compile(
+    r"\b(?:random|secrets|uuid|time|datetime|calendar|requests|yfinance|yf|input)\b"
+)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "worker.py")
+
+
+class WorkerPool:
     """
-    Validate and execute Python code in a subprocess.
+    Pool of long-lived Python worker subprocesses.
+
+    Each worker (worker.py) pre-imports numpy/pandas/matplotlib once at
+    spawn, then serves jobs as length-prefixed JSON frames over its
+    stdin/stdout pipes. A worker that exceeds the job timeout (or whose
+    pipe breaks) is killed and replaced with a fresh one.
+    """
+
+    def __init__(self, size: int | None = None):
+        self.size = size or min(os.cpu_count() or 1, 4)
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._workers: list[subprocess.Popen] = []
+
+    def _spawn(self) -> subprocess.Popen:
+        # No preexec_fn/cwd/extra fds here, so CPython launches this via
+        # posix_spawn (vfork-backed) rather than fork+exec — no copy of
+        # the parent's page tables. Spawns are rare anyway: workers are
+        # long-lived and only replaced after a timeout or crash.
+        return subprocess.Popen(
+            [sys.executable, "-u", WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env={**os.environ, "MPLBACKEND": "Agg"},
+        )
+
+    async def start(self):
+        for _ in range(self.size):
+            worker = await asyncio.to_thread(self._spawn)
+            self._workers.append(worker)
+            self._idle.put_nowait(worker)
+        logger.info(f"Worker pool started with {self.size} workers")
+
+    @staticmethod
+    def _request(worker: subprocess.Popen, job: dict) -> dict:
+        """Send a job frame and block for the result frame (runs in a thread)."""
+        payload = orjson.dumps(job)
+        worker.stdin.write(struct.pack(">I", len(payload)) + payload)
+        worker.stdin.flush()
+        header = worker.stdout.read(4)
+        if len(header) < 4:
+            raise RuntimeError("worker closed its pipe")
+        (length,) = struct.unpack(">I", header)
+        return orjson.loads(worker.stdout.read(length))
+
+    async def execute(self, code: str, output_dir: str) -> dict:
+        """Run code on an idle worker. Raises asyncio.TimeoutError on timeout."""
+        worker = await self._idle.get()
+        replace = False
+        try:
+            return await asyncio.wait_for(
+                asyncio.to_thread(self._request, worker, {"code": code, "output_dir": output_dir}),
+                timeout=EXECUTION_TIMEOUT,
+            )
+        except BaseException:
+            # Timeout or broken pipe: the worker may be wedged mid-job,
+            # so kill it rather than trust Popen to unwind (the watchdog
+            # pattern — don't rely on the child honoring anything).
+            replace = True
+            raise
+        finally:
+            if replace:
+                worker.kill()
+                await asyncio.to_thread(worker.wait)
+                try:
+                    self._workers.remove(worker)
+                except ValueError:
+                    pass
+                fresh = await asyncio.to_thread(self._spawn)
+                self._workers.append(fresh)
+                self._idle.put_nowait(fresh)
+            else:
+                self._idle.put_nowait(worker)
+
+    async def shutdown(self):
+        for worker in self._workers:
+            try:
+                worker.stdin.close()
+            except OSError:
+                pass
+        for worker in self._workers:
+            try:
+                await asyncio.wait_for(asyncio.to_thread(worker.wait), timeout=5)
+            except asyncio.TimeoutError:
+                worker.kill()
+        self._workers.clear()
+        self._idle = asyncio.Queue()
+
+
+_pool: WorkerPool | None = None
+
+
+async def get_worker_pool() -> WorkerPool:
+    """Return the shared pool, starting it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool()
+        await _pool.start()
+    return _pool
+
+
+async def shutdown_worker_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.shutdown()
+        _pool = None
+
+
+def _scan_images(output_dir: str, execution_id: str) -> list[str]:
+    """Collect URLs for PNGs the job wrote to its output dir.
+
+    os.scandir filters to PNGs before sorting, avoiding the extra stat
+    and full-listing sort that os.listdir required.
+    """
+    try:
+        with os.scandir(output_dir) as entries:
+            # Sort plot_N.png numerically — lexical order would put
+            # plot_10 before plot_2 on plot-heavy jobs
+            names = sorted(
+                (e.name for e in entries if e.name.endswith(".png")),
+                key=lambda n: (
+                    int(n[5:-4]) if n.startswith("plot_") and n[5:-4].isdigit() else -1,
+                    n,
+                ),
+            )
+    except FileNotFoundError:
+        return []
+    return [f"/api/code-output/{execution_id}/{name}" for name in names]
+
+
+def _remove_output_dir_if_empty(output_dir: str):
+    """Clean up the output dir if the job produced no images."""
+    if os.path.isdir(output_dir) and not os.listdir(output_dir):
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+async def execute_code(code: str) -> dict:
+    """
+    Validate and execute Python code on a pooled worker.
 
     Returns dict with: success, stdout, stderr, images, execution_id, errors
     """
@@ -148,85 +460,30 @@ def execute_code(code: str) -> dict:
             "errors": errors,
         }
 
+    cache_key = _code_digest(code)
+    cached = _result_cache.get(cache_key)
+    if cached is not None:
+        _result_cache.move_to_end(cache_key)
+        # Fresh lists too — a caller mutating its result must not write
+        # through into the cached entry
+        return {**cached, "images": list(cached["images"]), "errors": list(cached["errors"])}
+
     execution_id = str(uuid.uuid4())
     output_dir = os.path.join(OUTPUT_BASE_DIR, execution_id)
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Create a temp directory for the script to run in
-    work_dir = tempfile.mkdtemp(prefix="code_exec_")
-
-    # Build wrapper script that:
-    # 1. Sets matplotlib to non-interactive backend
-    # 2. Patches plt.show() to save figures as PNGs
-    # 3. Runs the user code
-    wrapper = f'''\
-import sys
-import os
-
-# Set up matplotlib if available (non-interactive backend, patched show)
-try:
-    import matplotlib
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-
-    _output_dir = {output_dir!r}
-    _plot_counter = [0]
+    await asyncio.to_thread(os.makedirs, output_dir, exist_ok=True)
 
-    _original_show = plt.show
-
-    def _patched_show(*args, **kwargs):
-        for fig_num in plt.get_fignums():
-            fig = plt.figure(fig_num)
-            _plot_counter[0] += 1
-            path = os.path.join(_output_dir, f"plot_{{_plot_counter[0]}}.png")
-            fig.savefig(path, dpi=150, bbox_inches="tight", facecolor="white")
-        plt.close("all")
-
-    plt.show = _patched_show
-    _has_matplotlib = True
-except ImportError:
-    _has_matplotlib = False
-
-# --- User code below ---
-{code}
-
-# Auto-save any remaining open figures
-if _has_matplotlib:
-    import matplotlib.pyplot as plt
-    if plt.get_fignums():
-        _patched_show()
-'''
-
-    script_path = os.path.join(work_dir, "script.py")
-    with open(script_path, "w") as f:
-        f.write(wrapper)
+    pool = await get_worker_pool()
 
     try:
-        result = subprocess.run(
-            [sys.executable if hasattr(sys, "executable") else "python3", script_path],
-            capture_output=True,
-            text=True,
-            timeout=30,
-            cwd=work_dir,
-            stdin=subprocess.DEVNULL,
-            env={
-                **os.environ,
-                "MPLBACKEND": "Agg",
-            },
-        )
+        result = await pool.execute(code, output_dir)
 
-        stdout = result.stdout[:MAX_STDOUT]
-        stderr = result.stderr[:MAX_STDERR]
+        stdout = result.get("stdout", "")[:MAX_STDOUT]
+        stderr = result.get("stderr", "")[:MAX_STDERR]
 
-        # Scan for output images
-        images = []
-        if os.path.isdir(output_dir):
-            for fname in sorted(os.listdir(output_dir)):
-                if fname.endswith(".png"):
-                    images.append(f"/api/code-output/{execution_id}/{fname}")
+        images = await asyncio.to_thread(_scan_images, output_dir, execution_id)
 
-        return {
-            "success": result.returncode == 0,
+        final = {
+            "success": bool(result.get("success")),
             "stdout": stdout,
             "stderr": stderr,
             "images": images,
@@ -234,14 +491,23 @@ if _has_matplotlib:
             "errors": [],
         }
 
-    except subprocess.TimeoutExpired:
+        if final["success"] and not images and not _NONDETERMINISTIC_RE.search(code):
+            # Store a copy, not the object being returned — same aliasing
+            # concern as on the hit path above
+            _result_cache[cache_key] = {**final, "images": [], "errors": []}
+            if len(_result_cache) > _RESULT_CACHE_SIZE:
+                _result_cache.popitem(last=False)
+
+        return final
+
+    except asyncio.TimeoutError:
         return {
             "success": False,
             "stdout": "",
-            "stderr": "Execution timed out after 30 seconds.",
+            "stderr": _TIMEOUT_MESSAGE,
             "images": [],
             "execution_id": execution_id,
-            "errors": ["Execution timed out after 30 seconds."],
+            "errors": [_TIMEOUT_MESSAGE],
         }
     except Exception as e:
         logger.exception("Code execution error")
@@ -254,11 +520,7 @@ if _has_matplotlib:
             "errors": [str(e)],
         }
     finally:
-        # Clean up the temporary work directory
-        shutil.rmtree(work_dir, ignore_errors=True)
-        # Clean up output dir if empty (no images produced)
-        if os.path.isdir(output_dir) and not os.listdir(output_dir):
-            shutil.rmtree(output_dir, ignore_errors=True)
+        await asyncio.to_thread(_remove_output_dir_if_empty, output_dir)
 
 
 def cleanup_old_outputs(max_age_hours: int = 1):
@@ -267,12 +529,16 @@ def cleanup_old_outputs(max_age_hours: int = 1):
         return
 
     cutoff = time.time() - (max_age_hours * 3600)
-    for name in os.listdir(OUTPUT_BASE_DIR):
-        path = os.path.join(OUTPUT_BASE_DIR, name)
-        if os.path.isdir(path):
+    # scandir serves is_dir/stat from the directory entry where the
+    # filesystem allows, instead of a separate syscall per path
+    with os.scandir(OUTPUT_BASE_DIR) as it:
+        for entry in it:
             try:
-                if os.path.getmtime(path) < cutoff:
-                    shutil.rmtree(path, ignore_errors=True)
-                    logger.info(f"Cleaned up old code output: {name}")
+                if (
+                    entry.is_dir(follow_symlinks=False)
+                    and entry.stat(follow_symlinks=False).st_mtime < cutoff
+                ):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    logger.info(f"Cleaned up old code output: {entry.name}")
             except OSError:
                 pass
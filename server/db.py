@@ -1,194 +1,238 @@
 import aiosqlite
+import time
 import uuid
 from datetime import datetime, timezone
 from pathlib import Path
 
 DB_PATH = Path(__file__).parent / "chat.db"
 
+# Timestamps come straight from the wall clock — rows written across
+# restarts must sort consistently, so no monotonic anchoring. The
+# date/time prefix only changes once per second, so cache the formatted
+# prefix and append fresh microseconds instead of re-running the full
+# datetime formatting per row.
+_ts_last_sec = 0
+_ts_prefix = ""
+
+
+def _now_iso() -> str:
+    global _ts_last_sec, _ts_prefix
+    ts = time.time()
+    sec = int(ts)
+    if sec != _ts_last_sec:
+        _ts_prefix = datetime.fromtimestamp(sec, timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%S"
+        )
+        _ts_last_sec = sec
+    return f"{_ts_prefix}.{int((ts - sec) * 1_000_000):06d}+00:00"
+
+# Single shared connection for the whole app. aiosqlite serializes all
+# statements onto one worker thread, and WAL mode lets readers proceed
+# during writes, so one connection is both safe and much cheaper than
+# the previous open/close (and PRAGMA re-run) per query.
+_db: aiosqlite.Connection | None = None
+
 
 async def get_db() -> aiosqlite.Connection:
-    db = await aiosqlite.connect(DB_PATH)
-    db.row_factory = aiosqlite.Row
-    await db.execute("PRAGMA journal_mode=WAL")
-    await db.execute("PRAGMA foreign_keys=ON")
-    return db
+    global _db
+    if _db is None:
+        # A larger statement cache means the handful of hot queries stay
+        # prepared for the life of the connection instead of being
+        # re-parsed by SQLite
+        _db = await aiosqlite.connect(DB_PATH, cached_statements=256)
+        _db.row_factory = aiosqlite.Row
+        await _db.execute("PRAGMA journal_mode=WAL")
+        await _db.execute("PRAGMA foreign_keys=ON")
+    return _db
+
+
+async def close_db():
+    global _db
+    if _db is not None:
+        await _db.close()
+        _db = None
 
 
 async def init_db():
     db = await get_db()
+    await db.executescript("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            summary TEXT DEFAULT '',
+            summary_up_to_index INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            conversation_id TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('user', 'assistant', 'tool')),
+            content TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation
+            ON messages(conversation_id, created_at);
+        -- Covering index: get_messages can be answered entirely from the
+        -- index (no table lookups per row), and count_messages stays an
+        -- index-only scan of the narrow index above
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation_covering
+            ON messages(conversation_id, created_at, id, role, content);
+    """)
+    # Add summary columns if upgrading from older schema
+    try:
+        await db.execute("ALTER TABLE conversations ADD COLUMN summary TEXT DEFAULT ''")
+    except Exception:
+        pass  # column already exists
     try:
-        await db.executescript("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id TEXT PRIMARY KEY,
-                title TEXT NOT NULL,
-                summary TEXT DEFAULT '',
-                summary_up_to_index INTEGER DEFAULT 0,
-                created_at TEXT NOT NULL
-            );
-            CREATE TABLE IF NOT EXISTS messages (
-                id TEXT PRIMARY KEY,
-                conversation_id TEXT NOT NULL,
-                role TEXT NOT NULL CHECK(role IN ('user', 'assistant', 'tool')),
-                content TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
-            );
-            CREATE INDEX IF NOT EXISTS idx_messages_conversation
-                ON messages(conversation_id, created_at);
-        """)
-        # Add summary columns if upgrading from older schema
-        try:
-            await db.execute("ALTER TABLE conversations ADD COLUMN summary TEXT DEFAULT ''")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE conversations ADD COLUMN summary_up_to_index INTEGER DEFAULT 0")
-        except Exception:
-            pass  # column already exists
-        await db.commit()
-    finally:
-        await db.close()
+        await db.execute("ALTER TABLE conversations ADD COLUMN summary_up_to_index INTEGER DEFAULT 0")
+    except Exception:
+        pass  # column already exists
+    await db.commit()
 
 
 async def create_conversation(title: str) -> dict:
     conv_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    now = _now_iso()
     db = await get_db()
-    try:
-        await db.execute(
-            "INSERT INTO conversations (id, title, summary, summary_up_to_index, created_at) "
-            "VALUES (?, ?, '', 0, ?)",
-            (conv_id, title, now),
-        )
-        await db.commit()
-        return {"id": conv_id, "title": title, "created_at": now}
-    finally:
-        await db.close()
+    cursor = await db.execute(
+        "INSERT INTO conversations (id, title, summary, summary_up_to_index, created_at) "
+        "VALUES (?, ?, '', 0, ?) RETURNING id, title, created_at",
+        (conv_id, title, now),
+    )
+    row = await cursor.fetchone()
+    await db.commit()
+    return dict(row)
 
 
 async def list_conversations() -> list[dict]:
     db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT id, title, created_at FROM conversations ORDER BY created_at DESC"
-        )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        await db.close()
+    cursor = await db.execute(
+        "SELECT id, title, created_at FROM conversations ORDER BY created_at DESC"
+    )
+    rows = await cursor.fetchall()
+    return [dict(row) for row in rows]
 
 
 async def get_conversation(conv_id: str) -> dict | None:
     db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT id, title, summary, summary_up_to_index, created_at "
-            "FROM conversations WHERE id = ?",
-            (conv_id,),
-        )
-        row = await cursor.fetchone()
-        if not row:
-            return None
-
-        conv = dict(row)
-
-        cursor = await db.execute(
-            "SELECT id, conversation_id, role, content, created_at "
-            "FROM messages WHERE conversation_id = ? ORDER BY created_at",
-            (conv_id,),
-        )
-        messages = await cursor.fetchall()
-        conv["messages"] = [dict(m) for m in messages]
-        return conv
-    finally:
-        await db.close()
+    cursor = await db.execute(
+        "SELECT id, title, summary, summary_up_to_index, created_at "
+        "FROM conversations WHERE id = ?",
+        (conv_id,),
+    )
+    row = await cursor.fetchone()
+    if not row:
+        return None
+
+    conv = dict(row)
+
+    cursor = await db.execute(
+        "SELECT id, conversation_id, role, content, created_at "
+        "FROM messages WHERE conversation_id = ? ORDER BY created_at",
+        (conv_id,),
+    )
+    messages = await cursor.fetchall()
+    conv["messages"] = [dict(m) for m in messages]
+    return conv
 
 
 async def get_conversation_summary(conv_id: str) -> tuple[str, int]:
     """Get the summary and the index up to which it covers."""
     db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT summary, summary_up_to_index FROM conversations WHERE id = ?",
-            (conv_id,),
-        )
-        row = await cursor.fetchone()
-        if not row:
-            return "", 0
-        return row["summary"] or "", row["summary_up_to_index"] or 0
-    finally:
-        await db.close()
+    cursor = await db.execute(
+        "SELECT summary, summary_up_to_index FROM conversations WHERE id = ?",
+        (conv_id,),
+    )
+    row = await cursor.fetchone()
+    if not row:
+        return "", 0
+    return row["summary"] or "", row["summary_up_to_index"] or 0
 
 
 async def update_conversation_summary(conv_id: str, summary: str, up_to_index: int):
     """Store the conversation summary and how many messages it covers."""
     db = await get_db()
-    try:
-        await db.execute(
-            "UPDATE conversations SET summary = ?, summary_up_to_index = ? WHERE id = ?",
-            (summary, up_to_index, conv_id),
-        )
-        await db.commit()
-    finally:
-        await db.close()
+    await db.execute(
+        "UPDATE conversations SET summary = ?, summary_up_to_index = ? WHERE id = ?",
+        (summary, up_to_index, conv_id),
+    )
+    await db.commit()
 
 
 async def delete_conversation(conv_id: str) -> bool:
     db = await get_db()
-    try:
-        cursor = await db.execute(
-            "DELETE FROM conversations WHERE id = ?", (conv_id,)
-        )
-        await db.commit()
-        return cursor.rowcount > 0
-    finally:
-        await db.close()
+    cursor = await db.execute(
+        "DELETE FROM conversations WHERE id = ?", (conv_id,)
+    )
+    await db.commit()
+    return cursor.rowcount > 0
 
 
 async def add_message(conversation_id: str, role: str, content: str) -> dict:
     msg_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    now = _now_iso()
     db = await get_db()
-    try:
-        await db.execute(
-            "INSERT INTO messages (id, conversation_id, role, content, created_at) "
-            "VALUES (?, ?, ?, ?, ?)",
-            (msg_id, conversation_id, role, content, now),
-        )
-        await db.commit()
-        return {
+    cursor = await db.execute(
+        "INSERT INTO messages (id, conversation_id, role, content, created_at) "
+        "VALUES (?, ?, ?, ?, ?) "
+        "RETURNING id, conversation_id, role, content, created_at",
+        (msg_id, conversation_id, role, content, now),
+    )
+    row = await cursor.fetchone()
+    await db.commit()
+    return dict(row)
+
+
+async def add_messages(conversation_id: str, messages: list[tuple[str, str]]) -> list[dict]:
+    """
+    Insert several (role, content) messages in a single transaction.
+
+    One executemany + one commit instead of a commit (and fsync) per
+    message — used to persist the user/tool/assistant messages of a chat
+    turn in one batch.
+    """
+    if not messages:
+        return []
+    db = await get_db()
+    rows = []
+    created = []
+    for role, content in messages:
+        msg_id = str(uuid.uuid4())
+        now = _now_iso()
+        rows.append((msg_id, conversation_id, role, content, now))
+        created.append({
             "id": msg_id,
             "conversation_id": conversation_id,
             "role": role,
             "content": content,
             "created_at": now,
-        }
-    finally:
-        await db.close()
+        })
+    await db.executemany(
+        "INSERT INTO messages (id, conversation_id, role, content, created_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    await db.commit()
+    return created
 
 
 async def get_messages(conversation_id: str) -> list[dict]:
     db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT id, conversation_id, role, content, created_at "
-            "FROM messages WHERE conversation_id = ? ORDER BY created_at",
-            (conversation_id,),
-        )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        await db.close()
+    cursor = await db.execute(
+        "SELECT id, conversation_id, role, content, created_at "
+        "FROM messages WHERE conversation_id = ? ORDER BY created_at",
+        (conversation_id,),
+    )
+    rows = await cursor.fetchall()
+    return [dict(row) for row in rows]
 
 
 async def count_messages(conversation_id: str) -> int:
     db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT COUNT(*) as cnt FROM messages WHERE conversation_id = ?",
-            (conversation_id,),
-        )
-        row = await cursor.fetchone()
-        return row["cnt"]
-    finally:
-        await db.close()
+    cursor = await db.execute(
+        "SELECT COUNT(*) as cnt FROM messages WHERE conversation_id = ?",
+        (conversation_id,),
+    )
+    row = await cursor.fetchone()
+    return row["cnt"]
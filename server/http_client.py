@@ -0,0 +1,31 @@
+"""
+Shared httpx.AsyncClient for all outbound HTTP (Ollama, Serper, page
+fetches).
+
+One client means one connection pool: keep-alive connections to Ollama
+and Serper get reused across requests instead of paying TCP (and TLS)
+setup plus pool construction on every call. Timeouts are passed
+per-request since Ollama streams need far longer than a Serper lookup.
+"""
+
+import httpx
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
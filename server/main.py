@@ -1,7 +1,12 @@
-import json
+import asyncio
 import logging
 import os
-from contextlib import asynccontextmanager
+import re
+import time
+from contextlib import asynccontextmanager, suppress
+
+import msgspec
+import orjson
 
 from dotenv import load_dotenv
 
@@ -11,21 +16,20 @@ logger = logging.getLogger(__name__)
 # Load env before other local imports so they pick up the values
 load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
 
 from db import (
     init_db,
+    close_db,
     create_conversation,
     list_conversations,
     get_conversation,
     delete_conversation,
-    add_message,
+    add_messages,
     get_messages,
-    count_messages,
     get_conversation_summary,
     update_conversation_summary,
 )
@@ -36,8 +40,15 @@ from ollama_client import (
     generate_summary,
     CONTEXT_WINDOW_SIZE,
 )
-from search import web_search
-from code_executor import execute_code, cleanup_old_outputs, OUTPUT_BASE_DIR
+from http_client import close_http_client
+from search import web_search, shutdown_extract_pool
+from code_executor import (
+    execute_code,
+    cleanup_old_outputs,
+    get_worker_pool,
+    shutdown_worker_pool,
+    OUTPUT_BASE_DIR,
+)
 
 
 # ---------------------------------------------------------------------------
@@ -48,8 +59,15 @@ from code_executor import execute_code, cleanup_old_outputs, OUTPUT_BASE_DIR
 async def lifespan(app: FastAPI):
     await init_db()
     os.makedirs(OUTPUT_BASE_DIR, exist_ok=True)
-    cleanup_old_outputs()
+    await asyncio.to_thread(cleanup_old_outputs)
+    # Warm the code execution workers so the first run_python call
+    # doesn't pay the numpy/pandas/matplotlib import cost
+    await get_worker_pool()
     yield
+    await shutdown_worker_pool()
+    shutdown_extract_pool()
+    await close_http_client()
+    await close_db()
 
 
 app = FastAPI(title="Local Chat API", lifespan=lifespan)
@@ -67,18 +85,170 @@ app.add_middleware(
 # Request / response models
 # ---------------------------------------------------------------------------
 
-class ChatRequest(BaseModel):
-    conversation_id: str | None = None
+# The chat request is decoded with msgspec rather than Pydantic: it sits
+# at the very start of the streaming path, and msgspec decodes these tiny
+# payloads several times faster than model validation
+class ChatRequest(msgspec.Struct):
     message: str
+    conversation_id: str | None = None
+
+
+_chat_request_decoder = msgspec.json.Decoder(ChatRequest)
 
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
 
-def _sse(data: dict) -> str:
-    """Format a dict as an SSE data line."""
-    return f"data: {json.dumps(data)}\n\n"
+def _sse(data: dict) -> bytes:
+    """Format a dict as a pre-encoded SSE data frame.
+
+    Returning bytes means StreamingResponse sends the frame as-is instead
+    of utf-8-encoding every yielded chunk.
+    """
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+# Coalesce streamed tokens: flush one SSE frame per this many buffered
+# characters instead of one frame (and one socket write) per token
+TOKEN_FLUSH_CHARS = 64
+# Flush buffered tokens at least this often, so slow generation still
+# renders smoothly instead of waiting for the byte threshold
+TOKEN_FLUSH_SECS = 0.05
+
+
+async def _forward_stream(messages: list[dict], collected: list[str]):
+    """
+    Relay an Ollama stream (no tools) as SSE events, coalescing content
+    tokens into buffered flushes. A flush happens when the buffer reaches
+    TOKEN_FLUSH_CHARS or TOKEN_FLUSH_SECS has elapsed since the last one,
+    whichever comes first. Tokens are appended to `collected` so the
+    caller can assemble the full response.
+    """
+    buf: list[str] = []
+    buf_len = 0
+    last_flush = time.monotonic()
+    async for chunk in stream_chat(messages, include_tools=False):
+        msg = chunk.get("message", {})
+        thinking = msg.get("thinking", "")
+        if thinking:
+            # Flush buffered tokens first to preserve event ordering
+            if buf:
+                yield _sse({"type": "token", "content": "".join(buf)})
+                buf = []
+                buf_len = 0
+                last_flush = time.monotonic()
+            yield _sse({"type": "thinking", "content": thinking})
+        token = msg.get("content", "")
+        if token:
+            collected.append(token)
+            buf.append(token)
+            buf_len += len(token)
+            now = time.monotonic()
+            if buf_len >= TOKEN_FLUSH_CHARS or now - last_flush >= TOKEN_FLUSH_SECS:
+                yield _sse({"type": "token", "content": "".join(buf)})
+                buf = []
+                buf_len = 0
+                last_flush = now
+    if buf:
+        yield _sse({"type": "token", "content": "".join(buf)})
+
+
+# Emit an SSE comment when the stream has been silent this long, so
+# proxies and the browser don't time out a connection that's just waiting
+# on a slow model or tool call
+KEEPALIVE_SECS = 15.0
+
+
+async def _with_keepalive(stream):
+    """Wrap an SSE byte stream, injecting comment pings during idle gaps.
+
+    SSE comments (lines starting with ':') are ignored by EventSource, so
+    the pings are invisible to the client while still moving bytes on the
+    wire. This covers the flush/keepalive duty sse-starlette would
+    provide, without giving up our pre-encoded byte frames.
+    """
+    events = aiter(stream)
+    task = None
+    try:
+        while True:
+            task = asyncio.ensure_future(anext(events))
+            while True:
+                try:
+                    event = await asyncio.wait_for(asyncio.shield(task), KEEPALIVE_SECS)
+                    break
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                except StopAsyncIteration:
+                    return
+            yield event
+    finally:
+        # On client disconnect this generator is closed from outside; the
+        # shielded anext task would otherwise keep running detached and
+        # the wrapped generator's own finally blocks would never fire
+        if task is not None and not task.done():
+            task.cancel()
+            with suppress(asyncio.CancelledError, StopAsyncIteration):
+                await task
+        await events.aclose()
+
+
+async def _execute_one_tool_call(tc: dict) -> tuple[dict, dict | None]:
+    """
+    Execute a single tool call. Returns (tool_result_message, code_result)
+    where code_result is the code execution output for SSE emission, or
+    None for non-code tools.
+    """
+    fn = tc.get("function", {})
+    name = fn.get("name", "")
+    args = fn.get("arguments", {})
+    if isinstance(args, str):
+        try:
+            args = orjson.loads(args)
+        except orjson.JSONDecodeError:
+            args = {}
+
+    if name == "web_search":
+        query = args.get("query", "")
+        logger.info(f"Executing web_search for: {query}")
+        search_result = await web_search(query)
+        logger.info(f"Search result length: {len(search_result)}")
+        return {"role": "tool", "content": search_result}, None
+
+    if name == "run_python":
+        code = args.get("code", "")
+        logger.info(f"Executing run_python ({len(code)} chars)")
+        exec_result = await execute_code(code)
+        logger.info(
+            f"Code execution: success={exec_result['success']}, "
+            f"stdout={len(exec_result['stdout'])} chars, "
+            f"images={len(exec_result['images'])}"
+        )
+
+        # Build tool result content for Ollama
+        parts = []
+        if exec_result["errors"]:
+            parts.append("VALIDATION ERRORS:\n" + "\n".join(exec_result["errors"]))
+        if exec_result["stdout"]:
+            parts.append("STDOUT:\n" + exec_result["stdout"])
+        if exec_result["stderr"]:
+            parts.append("STDERR:\n" + exec_result["stderr"])
+        if exec_result["images"]:
+            parts.append("IMAGES:\n" + "\n".join(exec_result["images"]))
+        if not parts:
+            parts.append("Code executed successfully with no output.")
+
+        code_result = {
+            "code": code,
+            "stdout": exec_result["stdout"],
+            "stderr": exec_result["stderr"],
+            "images": exec_result["images"],
+            "success": exec_result["success"],
+            "errors": exec_result["errors"],
+        }
+        return {"role": "tool", "content": "\n\n".join(parts)}, code_result
+
+    return {"role": "tool", "content": f"Unknown tool: {name}"}, None
 
 
 async def _execute_tool_calls(
@@ -86,75 +256,42 @@ async def _execute_tool_calls(
     code_results: list[dict] | None = None,
 ) -> list[dict]:
     """
-    Execute each tool call and return a list of tool-result messages
-    suitable for appending to the Ollama messages array.
+    Execute all tool calls concurrently and return tool-result messages
+    in the original call order (a searching call no longer waits for a
+    code execution to finish, and vice versa).
 
     If code_results list is provided, code execution outputs are appended
     to it for SSE event emission.
     """
-    results: list[dict] = []
-    for tc in tool_calls:
-        fn = tc.get("function", {})
-        name = fn.get("name", "")
-        args = fn.get("arguments", {})
-        if isinstance(args, str):
-            try:
-                args = json.loads(args)
-            except json.JSONDecodeError:
-                args = {}
-
-        if name == "web_search":
-            query = args.get("query", "")
-            logger.info(f"Executing web_search for: {query}")
-            search_result = await web_search(query)
-            logger.info(f"Search result length: {len(search_result)}")
-            results.append({"role": "tool", "content": search_result})
-
-        elif name == "run_python":
-            code = args.get("code", "")
-            logger.info(f"Executing run_python ({len(code)} chars)")
-            exec_result = execute_code(code)
-            logger.info(
-                f"Code execution: success={exec_result['success']}, "
-                f"stdout={len(exec_result['stdout'])} chars, "
-                f"images={len(exec_result['images'])}"
-            )
-
-            # Build tool result content for Ollama
-            parts = []
-            if exec_result["errors"]:
-                parts.append("VALIDATION ERRORS:\n" + "\n".join(exec_result["errors"]))
-            if exec_result["stdout"]:
-                parts.append("STDOUT:\n" + exec_result["stdout"])
-            if exec_result["stderr"]:
-                parts.append("STDERR:\n" + exec_result["stderr"])
-            if exec_result["images"]:
-                parts.append("IMAGES:\n" + "\n".join(exec_result["images"]))
-            if not parts:
-                parts.append("Code executed successfully with no output.")
-
-            results.append({"role": "tool", "content": "\n\n".join(parts)})
-
-            # Store for SSE emission
-            if code_results is not None:
-                code_results.append({
-                    "code": code,
-                    "stdout": exec_result["stdout"],
-                    "stderr": exec_result["stderr"],
-                    "images": exec_result["images"],
-                    "success": exec_result["success"],
-                    "errors": exec_result["errors"],
-                })
-        else:
-            results.append({"role": "tool", "content": f"Unknown tool: {name}"})
-
-    return results
+    outcomes = await asyncio.gather(
+        *(_execute_one_tool_call(tc) for tc in tool_calls)
+    )
+    if code_results is not None:
+        code_results.extend(cr for _, cr in outcomes if cr is not None)
+    return [msg for msg, _ in outcomes]
 
 
 # ---------------------------------------------------------------------------
 # SSE streaming generator
 # ---------------------------------------------------------------------------
 
+# Pure smalltalk (greetings, acks, thanks) never needs a tool, so those
+# turns can skip the non-streaming tool-detection pass entirely and go
+# straight to streaming. Deliberately conservative: anything that doesn't
+# match still takes the reliable two-pass path.
+_SMALLTALK_RE = re.compile(
+    r"^(?:hi|hiya|hey|hello|yo|thanks|thank you|thx|ty|ok|okay|cool|nice|"
+    r"great|bye|goodbye|good morning|good night|lol|haha)[\s!.?]*$",
+    re.IGNORECASE,
+)
+
+
+def _skip_tool_probe(user_message: str) -> bool:
+    """True if the message is trivially conversational (no tool needed)."""
+    stripped = user_message.strip()
+    return len(stripped) <= 40 and _SMALLTALK_RE.match(stripped) is not None
+
+
 async def _chat_stream(conversation_id: str, user_message: str):
     """
     Generator that yields SSE events for a chat turn.
@@ -168,150 +305,186 @@ async def _chat_stream(conversation_id: str, user_message: str):
     """
 
     # -- Build messages from conversation history with sliding window -----
-    db_msgs = await get_messages(conversation_id)
-    summary, summary_up_to = await get_conversation_summary(conversation_id)
+    # The two reads are independent — overlap them instead of paying two
+    # serial round-trips before the model call
+    db_msgs, (summary, summary_up_to) = await asyncio.gather(
+        get_messages(conversation_id),
+        get_conversation_summary(conversation_id),
+    )
     ollama_messages = _build_ollama_messages(
         db_msgs, new_user_message=user_message, summary=summary
     )
 
-    # -- Save user message to DB ------------------------------------------
-    await add_message(conversation_id, "user", user_message)
-
-    # -- Step 1: Non-streaming call with tools to detect tool calls --------
-    # Qwen's thinking mode can swallow tool calls during streaming,
-    # so we do a non-streaming first pass for reliable tool detection.
-    yield _sse({"type": "thinking", "content": "Thinking"})
+    # -- Collect this turn's messages; they're flushed to the DB in one
+    # transaction at the end of the stream — or by the finally below, so
+    # an error or mid-stream client disconnect can't drop them -------------
+    pending_messages: list[tuple[str, str]] = [("user", user_message)]
+    collected_content = ""
+    persist_task: asyncio.Task | None = None
+    tool_result_messages: list[dict] = []
 
     try:
-        first_response = await chat_no_stream(ollama_messages, include_tools=True)
-    except Exception as e:
-        logger.exception("Ollama non-streaming error")
-        yield _sse({"type": "error", "content": f"Ollama error: {str(e)}"})
-        yield _sse({"type": "done", "conversation_id": conversation_id})
-        return
-
-    first_msg = first_response.get("message", {})
-    tool_calls = first_msg.get("tool_calls", [])
-    first_content = first_msg.get("content", "")
-    first_thinking = first_msg.get("thinking", "")
+        # -- Step 1: Non-streaming call with tools to detect tool calls --------
+        # Qwen's thinking mode can swallow tool calls during streaming,
+        # so we do a non-streaming first pass for reliable tool detection.
+        # Smalltalk turns skip the probe and stream immediately.
+        if _skip_tool_probe(user_message):
+            logger.info("Smalltalk message — skipping tool-detection pass")
+            tool_calls = []
+            first_content = ""
+            first_thinking = ""
+        else:
+            yield _sse({"type": "thinking", "content": "Thinking"})
 
-    # Forward the thinking from the first pass
-    if first_thinking:
-        yield _sse({"type": "thinking", "content": "...\n" + first_thinking})
+            try:
+                first_response = await chat_no_stream(ollama_messages, include_tools=True)
+            except Exception as e:
+                logger.exception("Ollama non-streaming error")
+                yield _sse({"type": "error", "content": f"Ollama error: {str(e)}"})
+                yield _sse({"type": "done", "conversation_id": conversation_id})
+                return
 
-    logger.info(f"First pass: tool_calls={len(tool_calls)}, content_len={len(first_content)}, thinking_len={len(first_thinking)}")
+            first_msg = first_response.get("message", {})
+            tool_calls = first_msg.get("tool_calls", [])
+            first_content = first_msg.get("content", "")
+            first_thinking = first_msg.get("thinking", "")
+
+        # The first-pass thinking is not forwarded: it can be many KB in one
+        # SSE frame right before the first real token, and the streaming pass
+        # produces its own thinking anyway. It still lands in the log below.
+        logger.info(f"First pass: tool_calls={len(tool_calls)}, content_len={len(first_content)}, thinking_len={len(first_thinking)}")
+
+        if tool_calls:
+            # Kick off tool execution immediately — the status events below
+            # then go out while the tools are already running, instead of
+            # execution starting only after the whole batch is announced
+            code_results: list[dict] = []
+            exec_task = asyncio.create_task(_execute_tool_calls(tool_calls, code_results))
+
+            # Notify the frontend about tool activity
+            for tc in tool_calls:
+                fn_name = tc.get("function", {}).get("name", "unknown")
+                fn_args = tc.get("function", {}).get("arguments", {})
+                if isinstance(fn_args, str):
+                    try:
+                        fn_args = orjson.loads(fn_args)
+                    except orjson.JSONDecodeError:
+                        fn_args = {}
+                if fn_name == "web_search":
+                    query = fn_args.get("query", "")
+                    yield _sse({"type": "tool_status", "content": f"Searching the web for: {query}"})
+                elif fn_name == "run_python":
+                    yield _sse({"type": "tool_status", "content": "Running Python code..."})
+                else:
+                    yield _sse({"type": "tool_status", "content": f"Calling tool: {fn_name}"})
+
+            # Wait for the tool calls kicked off above
+            tool_result_messages = await exec_task
+
+            # Emit code_output SSE events
+            for cr in code_results:
+                yield _sse({
+                    "type": "code_output",
+                    "code": cr["code"],
+                    "stdout": cr["stdout"],
+                    "stderr": cr["stderr"],
+                    "images": cr["images"],
+                    "success": cr["success"],
+                })
 
-    collected_content = ""
+            # Build updated message list for the follow-up call
+            follow_up_messages = list(ollama_messages)
+            # The assistant message that triggered tool calls (don't include
+            # any "let me search" filler content — keep it minimal)
+            assistant_tc_msg = {"role": "assistant", "content": "", "tool_calls": tool_calls}
+            follow_up_messages.append(assistant_tc_msg)
+            follow_up_messages.extend(tool_result_messages)
+
+            # Persist the user + tool messages in the background while the
+            # follow-up answer streams, instead of paying the write after it
+            pending_messages.extend(("tool", trm["content"]) for trm in tool_result_messages)
+            persist_task = asyncio.create_task(
+                add_messages(conversation_id, pending_messages)
+            )
+            pending_messages = []
 
-    if tool_calls:
-        # Notify the frontend about tool activity
-        for tc in tool_calls:
-            fn_name = tc.get("function", {}).get("name", "unknown")
-            fn_args = tc.get("function", {}).get("arguments", {})
-            if isinstance(fn_args, str):
-                try:
-                    fn_args = json.loads(fn_args)
-                except json.JSONDecodeError:
-                    fn_args = {}
-            if fn_name == "web_search":
-                query = fn_args.get("query", "")
-                yield _sse({"type": "tool_status", "content": f"Searching the web for: {query}"})
-            elif fn_name == "run_python":
-                yield _sse({"type": "tool_status", "content": "Running Python code..."})
-            else:
-                yield _sse({"type": "tool_status", "content": f"Calling tool: {fn_name}"})
-
-        # Execute the tool calls
-        code_results: list[dict] = []
-        tool_result_messages = await _execute_tool_calls(tool_calls, code_results)
-
-        # Emit code_output SSE events
-        for cr in code_results:
-            yield _sse({
-                "type": "code_output",
-                "code": cr["code"],
-                "stdout": cr["stdout"],
-                "stderr": cr["stderr"],
-                "images": cr["images"],
-                "success": cr["success"],
-            })
-
-        # Build updated message list for the follow-up call
-        follow_up_messages = list(ollama_messages)
-        # The assistant message that triggered tool calls (don't include
-        # any "let me search" filler content — keep it minimal)
-        assistant_tc_msg = {"role": "assistant", "content": "", "tool_calls": tool_calls}
-        follow_up_messages.append(assistant_tc_msg)
-        follow_up_messages.extend(tool_result_messages)
-
-        # Save tool result messages to DB
-        for trm in tool_result_messages:
-            await add_message(conversation_id, "tool", trm["content"])
-
-        # Stream the final answer after tool results
-        try:
-            async for chunk in stream_chat(follow_up_messages, include_tools=False):
-                msg = chunk.get("message", {})
-                thinking = msg.get("thinking", "")
-                if thinking:
-                    yield _sse({"type": "thinking", "content": thinking})
-                token = msg.get("content", "")
-                if token:
-                    collected_content += token
-                    yield _sse({"type": "token", "content": token})
-        except Exception as e:
-            logger.exception("Ollama follow-up streaming error")
-            yield _sse({"type": "error", "content": f"Ollama error on follow-up: {str(e)}"})
-            yield _sse({"type": "done", "conversation_id": conversation_id})
-            return
-
-        logger.info(f"Follow-up response length: {len(collected_content)}")
-    else:
-        # No tool calls — stream a response (reuse first_content if available)
-        if first_content:
-            collected_content = first_content
-            yield _sse({"type": "token", "content": first_content})
-        else:
-            # Stream a fresh response without tools
+            # Stream the final answer after tool results
+            collected_tokens: list[str] = []
             try:
-                async for chunk in stream_chat(ollama_messages, include_tools=False):
-                    msg = chunk.get("message", {})
-                    thinking = msg.get("thinking", "")
-                    if thinking:
-                        yield _sse({"type": "thinking", "content": thinking})
-                    token = msg.get("content", "")
-                    if token:
-                        collected_content += token
-                        yield _sse({"type": "token", "content": token})
+                async for event in _forward_stream(follow_up_messages, collected_tokens):
+                    yield event
+                collected_content = "".join(collected_tokens)
             except Exception as e:
-                yield _sse({"type": "error", "content": f"Ollama error: {str(e)}"})
+                logger.exception("Ollama follow-up streaming error")
+                yield _sse({"type": "error", "content": f"Ollama error on follow-up: {str(e)}"})
                 yield _sse({"type": "done", "conversation_id": conversation_id})
                 return
 
-    # -- Save assistant response to DB ------------------------------------
-    if collected_content:
-        await add_message(conversation_id, "assistant", collected_content)
-
-    # -- Summarize older messages if conversation is getting long ----------
-    total_msgs = await count_messages(conversation_id)
-    # Trigger summarization when we have more than the window size
-    # and either no summary yet or summary is stale (10+ new messages since last summary)
-    if total_msgs > CONTEXT_WINDOW_SIZE:
-        msgs_since_summary = total_msgs - summary_up_to
-        if not summary or msgs_since_summary > CONTEXT_WINDOW_SIZE + 10:
-            all_msgs = await get_messages(conversation_id)
-            # Summarize everything except the last CONTEXT_WINDOW_SIZE messages
-            msgs_to_summarize = all_msgs[:-CONTEXT_WINDOW_SIZE]
-            if msgs_to_summarize:
-                logger.info(
-                    f"Generating summary for {len(msgs_to_summarize)} older messages "
-                    f"(total: {total_msgs})"
-                )
-                new_summary = await generate_summary(msgs_to_summarize)
-                if new_summary:
-                    await update_conversation_summary(
-                        conversation_id, new_summary, len(msgs_to_summarize)
+            logger.info(f"Follow-up response length: {len(collected_content)}")
+        else:
+            # No tool calls — stream a response (reuse first_content if available)
+            if first_content:
+                collected_content = first_content
+                yield _sse({"type": "token", "content": first_content})
+            else:
+                # Stream a fresh response without tools
+                collected_tokens = []
+                try:
+                    async for event in _forward_stream(ollama_messages, collected_tokens):
+                        yield event
+                    collected_content = "".join(collected_tokens)
+                except Exception as e:
+                    yield _sse({"type": "error", "content": f"Ollama error: {str(e)}"})
+                    yield _sse({"type": "done", "conversation_id": conversation_id})
+                    return
+
+        # -- Flush the rest of the turn; the user + tool batch may already be
+        # persisting in the background ----------------------------------------
+        if persist_task is not None:
+            await persist_task
+        if collected_content:
+            pending_messages.append(("assistant", collected_content))
+        await add_messages(conversation_id, pending_messages)
+        pending_messages = []
+
+        # -- Summarize older messages if conversation is getting long ----------
+        # The full history is already in hand: the db_msgs fetched at the top
+        # of the turn plus what this turn just wrote — no need to re-read the
+        # conversation or issue a COUNT
+        new_msgs = [{"role": "user", "content": user_message}]
+        new_msgs += [{"role": "tool", "content": trm["content"]} for trm in tool_result_messages]
+        if collected_content:
+            new_msgs.append({"role": "assistant", "content": collected_content})
+        all_msgs = db_msgs + new_msgs
+        total_msgs = len(all_msgs)
+        # Trigger summarization when we have more than the window size
+        # and either no summary yet or summary is stale (10+ new messages since last summary)
+        if total_msgs > CONTEXT_WINDOW_SIZE:
+            msgs_since_summary = total_msgs - summary_up_to
+            if not summary or msgs_since_summary > CONTEXT_WINDOW_SIZE + 10:
+                # Fold the existing summary forward: only the messages added
+                # since the last pass need summarizing, not the whole history
+                new_up_to = total_msgs - CONTEXT_WINDOW_SIZE
+                msgs_to_summarize = all_msgs[summary_up_to:new_up_to]
+                if msgs_to_summarize:
+                    logger.info(
+                        f"Updating summary with {len(msgs_to_summarize)} new messages "
+                        f"(total: {total_msgs})"
                     )
+                    new_summary = await generate_summary(msgs_to_summarize, summary)
+                    if new_summary:
+                        await update_conversation_summary(
+                            conversation_id, new_summary, new_up_to
+                        )
+
+    finally:
+        # A client disconnect (stop, refresh, navigation) closes this
+        # generator early — flush whatever the turn has produced so the
+        # user message and tool results are never silently dropped
+        if persist_task is not None:
+            await persist_task
+        if pending_messages:
+            await add_messages(conversation_id, pending_messages)
 
     # -- Done event -------------------------------------------------------
     yield _sse({"type": "done", "conversation_id": conversation_id})
@@ -322,8 +495,13 @@ async def _chat_stream(conversation_id: str, user_message: str):
 # ---------------------------------------------------------------------------
 
 @app.post("/api/chat")
-async def chat(req: ChatRequest):
+async def chat(request: Request):
     """Send a message and receive a streamed SSE response."""
+    try:
+        req = _chat_request_decoder.decode(await request.body())
+    except (msgspec.DecodeError, msgspec.ValidationError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
     conversation_id = req.conversation_id
 
     if not conversation_id:
@@ -340,7 +518,7 @@ async def chat(req: ChatRequest):
             raise HTTPException(status_code=404, detail="Conversation not found")
 
     return StreamingResponse(
-        _chat_stream(conversation_id, req.message),
+        _with_keepalive(_chat_stream(conversation_id, req.message)),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -378,8 +556,25 @@ async def conversation_delete(conv_id: str):
 # Static files for code execution output (plots, images)
 # ---------------------------------------------------------------------------
 
+class _ImmutableStaticFiles(StaticFiles):
+    """
+    Static file serving with immutable-cache headers.
+
+    Output dirs are keyed by a fresh UUID per execution, so the content
+    behind a given URL never changes — let the browser cache plots
+    instead of re-fetching them when a conversation is re-rendered.
+    StaticFiles already answers conditional requests (ETag /
+    Last-Modified) with 304s; max-age matches the 1h output retention.
+    """
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=3600, immutable"
+        return response
+
+
 os.makedirs(OUTPUT_BASE_DIR, exist_ok=True)
-app.mount("/api/code-output", StaticFiles(directory=OUTPUT_BASE_DIR), name="code-output")
+app.mount("/api/code-output", _ImmutableStaticFiles(directory=OUTPUT_BASE_DIR), name="code-output")
 
 # ---------------------------------------------------------------------------
 # Entrypoint
@@ -387,4 +582,14 @@ app.mount("/api/code-output", StaticFiles(directory=OUTPUT_BASE_DIR), name="code
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # uvloop + httptools take over the event loop and HTTP parsing —
+    # meaningfully less per-request overhead on the SSE streaming path
+    # than stdlib asyncio + h11
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=True,
+        loop="uvloop",
+        http="httptools",
+    )
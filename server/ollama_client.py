@@ -1,28 +1,86 @@
+import functools
 import os
-import json
 import logging
 from datetime import date
+from types import MappingProxyType
 
 import httpx
+import orjson
 from collections.abc import AsyncGenerator
 
+from http_client import get_http_client
+
 logger = logging.getLogger(__name__)
 
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen3.5:35b-a3b")
 
+# Request bodies are serialized with orjson (notably faster than the
+# stdlib for the large nested messages arrays we send per call)
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Hoisted once: every chat call hits the same endpoint, and httpx.Timeout
+# objects are immutable, so there's no reason to rebuild them per call
+# (or per retry attempt)
+_OLLAMA_CHAT_URL = f"{OLLAMA_BASE_URL}/api/chat"
+_CHAT_TIMEOUT = httpx.Timeout(300.0, connect=10.0)
+_SUMMARY_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
 # Sliding window: keep last N messages as full context
 CONTEXT_WINDOW_SIZE = 20
+# Rough token budget for the windowed messages (~4 chars/token). A handful
+# of huge tool results can blow past the model's context long before the
+# 20-message cap does, so the window is also trimmed by estimated size.
+CONTEXT_TOKEN_BUDGET = 12000
+
 
-SYSTEM_PROMPT = f"""You are a helpful AI assistant. Today's date is {date.today().strftime('%B %d, %Y')}.
+def _estimate_tokens(msg: dict) -> int:
+    """Crude token estimate for a message (~4 chars per token)."""
+    return (len(msg.get("content", "")) + len(msg.get("role", ""))) // 4
 
-When you need current or recent information, use the web_search tool. Always include the current year ({date.today().year}) in your search queries for time-sensitive topics.
+
+_SYSTEM_PROMPT_TEMPLATE = """You are a helpful AI assistant. Today's date is {date}.
+
+When you need current or recent information, use the web_search tool. Always include the current year ({year}) in your search queries for time-sensitive topics.
 
 When presenting information from web searches, cite your sources and be clear about what is current vs. historical data.
 
 You can run Python code using the run_python tool for calculations, data analysis, plots, and fetching data. Always call plt.show() for plots."""
 
-TOOLS = [
+
+@functools.lru_cache(maxsize=1)
+def _system_message_for(ordinal: int) -> dict:
+    """System message for the given day, built once per day.
+
+    Keyed by date ordinal so a server left running overnight starts
+    telling the model the right date, instead of the import-time one,
+    while still paying the format cost only at midnight.
+    """
+    today = date.fromordinal(ordinal)
+    return {
+        "role": "system",
+        "content": _SYSTEM_PROMPT_TEMPLATE.format(
+            date=today.strftime("%B %d, %Y"), year=today.year
+        ),
+    }
+
+
+# Import-time snapshot, kept for callers (and tests) that just need the
+# prompt text; message building below always uses the current day
+SYSTEM_PROMPT = _system_message_for(date.today().toordinal())["content"]
+
+# Same for the summarizer instructions, rebuilt per summary call before
+_SUMMARY_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": (
+        "You are a summarizer. Maintain a brief running summary of a conversation "
+        "(3-5 sentences). Capture key topics discussed, any decisions made, "
+        "important facts mentioned, and user preferences expressed. "
+        "Be concise but preserve important context."
+    ),
+}
+
+_RAW_TOOLS = [
     {
         "type": "function",
         "function": {
@@ -69,6 +127,26 @@ TOOLS = [
     },
 ]
 
+# Shared read-only view: every request references the same TOOLS object,
+# and the proxy makes accidental mutation by a caller impossible instead
+# of silently global
+TOOLS = tuple(MappingProxyType(t) for t in _RAW_TOOLS)
+
+# The tools block is byte-identical in every request — serialize it once
+# and splice the bytes into each payload instead of re-encoding per call
+_TOOLS_JSON = orjson.dumps(_RAW_TOOLS)
+
+
+def _chat_payload(messages: list[dict], stream: bool, include_tools: bool) -> bytes:
+    """Serialized /api/chat request body, with the pre-encoded tools
+    block spliced in before the closing brace when requested."""
+    body = orjson.dumps(
+        {"model": OLLAMA_MODEL, "messages": messages, "stream": stream}
+    )
+    if include_tools:
+        body = b'%s,"tools":%s}' % (body[:-1], _TOOLS_JSON)
+    return body
+
 
 def _build_ollama_messages(
     db_messages: list[dict],
@@ -82,14 +160,13 @@ def _build_ollama_messages(
     If it's long, prepend the summary of older messages and only include
     the most recent CONTEXT_WINDOW_SIZE messages in full.
     """
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-
+    summary_msg = None
     if summary and len(db_messages) > CONTEXT_WINDOW_SIZE:
         # Inject summary of older context, then only recent messages
-        messages.append({
+        summary_msg = {
             "role": "system",
             "content": f"Summary of earlier conversation:\n{summary}",
-        })
+        }
         recent = db_messages[-CONTEXT_WINDOW_SIZE:]
         logger.info(
             f"Using sliding window: {len(db_messages)} total msgs, "
@@ -99,22 +176,48 @@ def _build_ollama_messages(
         # Conversation is short enough — send everything
         recent = db_messages
 
-    for msg in recent:
-        messages.append({"role": msg["role"], "content": msg["content"]})
-
-    if new_user_message:
-        messages.append({"role": "user", "content": new_user_message})
-
-    return messages
+    # Enforce the token budget on top of the message cap: drop the oldest
+    # windowed messages while the estimated total is over budget, always
+    # keeping at least the last two so the model sees the latest exchange.
+    total_tokens = sum(_estimate_tokens(m) for m in recent)
+    if total_tokens > CONTEXT_TOKEN_BUDGET and len(recent) > 2:
+        trimmed = list(recent)
+        while total_tokens > CONTEXT_TOKEN_BUDGET and len(trimmed) > 2:
+            total_tokens -= _estimate_tokens(trimmed.pop(0))
+        logger.info(
+            f"Token budget trim: {len(recent)} -> {len(trimmed)} msgs "
+            f"(~{total_tokens} tokens)"
+        )
+        recent = trimmed
+
+    # Single splat build: the list is allocated once at its final size
+    # instead of growing through a prepend plus N appends
+    return [
+        _system_message_for(date.today().toordinal()),
+        *((summary_msg,) if summary_msg else ()),
+        *({"role": m["role"], "content": m["content"]} for m in recent),
+        *(
+            ({"role": "user", "content": new_user_message},)
+            if new_user_message
+            else ()
+        ),
+    ]
 
 
-async def generate_summary(messages_to_summarize: list[dict]) -> str:
+async def generate_summary(
+    messages_to_summarize: list[dict],
+    previous_summary: str = "",
+) -> str:
     """
     Ask Ollama to summarize a batch of conversation messages.
     This runs as a quick non-streaming call with no tools.
+
+    When a previous summary exists, it is folded into the prompt and the
+    model updates it with only the new messages — so each pass tokenizes
+    the delta since the last summary instead of the whole older history.
     """
     if not messages_to_summarize:
-        return ""
+        return previous_summary
 
     # Build a transcript of the messages to summarize
     transcript_lines = []
@@ -128,37 +231,40 @@ async def generate_summary(messages_to_summarize: list[dict]) -> str:
 
     transcript = "\n".join(transcript_lines)
 
+    if previous_summary:
+        user_content = (
+            f"Here is the running summary of the conversation so far:\n\n"
+            f"{previous_summary}\n\n"
+            f"Update it with these new messages:\n\n{transcript}"
+        )
+    else:
+        user_content = f"Summarize this conversation:\n\n{transcript}"
+
     summary_prompt = [
-        {
-            "role": "system",
-            "content": (
-                "You are a summarizer. Condense the following conversation into a brief "
-                "summary (3-5 sentences). Capture key topics discussed, any decisions made, "
-                "important facts mentioned, and user preferences expressed. "
-                "Be concise but preserve important context."
-            ),
-        },
+        _SUMMARY_SYSTEM_MESSAGE,
         {
             "role": "user",
-            "content": f"Summarize this conversation:\n\n{transcript}",
+            "content": user_content,
         },
     ]
 
     try:
-        async with httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0)) as client:
-            response = await client.post(
-                f"{OLLAMA_BASE_URL}/api/chat",
-                json={
-                    "model": OLLAMA_MODEL,
-                    "messages": summary_prompt,
-                    "stream": False,
-                },
-            )
-            response.raise_for_status()
-            data = response.json()
-            summary = data.get("message", {}).get("content", "")
-            logger.info(f"Generated summary ({len(summary)} chars) for {len(messages_to_summarize)} messages")
-            return summary
+        client = get_http_client()
+        response = await client.post(
+            _OLLAMA_CHAT_URL,
+            content=orjson.dumps({
+                "model": OLLAMA_MODEL,
+                "messages": summary_prompt,
+                "stream": False,
+            }),
+            headers=_JSON_HEADERS,
+            timeout=_SUMMARY_TIMEOUT,
+        )
+        response.raise_for_status()
+        data = response.json()
+        summary = data.get("message", {}).get("content", "")
+        logger.info(f"Generated summary ({len(summary)} chars) for {len(messages_to_summarize)} messages")
+        return summary
     except Exception as e:
         logger.error(f"Failed to generate summary: {e}")
         return ""
@@ -175,29 +281,38 @@ async def stream_chat(
     Each chunk has at minimum: {"message": {"role": ..., "content": ...}, "done": bool}
     The final chunk (done=true) contains the complete assembled message.
     """
-    payload = {
-        "model": OLLAMA_MODEL,
-        "messages": messages,
-        "stream": True,
-    }
-    if include_tools:
-        payload["tools"] = TOOLS
-
-    async with httpx.AsyncClient(timeout=httpx.Timeout(300.0, connect=10.0)) as client:
-        async with client.stream(
-            "POST",
-            f"{OLLAMA_BASE_URL}/api/chat",
-            json=payload,
-        ) as response:
-            response.raise_for_status()
-            async for line in response.aiter_lines():
+    client = get_http_client()
+    async with client.stream(
+        "POST",
+        _OLLAMA_CHAT_URL,
+        content=_chat_payload(messages, stream=True, include_tools=include_tools),
+        headers=_JSON_HEADERS,
+        timeout=_CHAT_TIMEOUT,
+    ) as response:
+        response.raise_for_status()
+        # Split the NDJSON stream on bytes: aiter_bytes avoids the
+        # str-decode and universal-newline handling aiter_lines applies
+        # to every chunk, and orjson parses the byte lines directly.
+        # (Not aiter_raw — that would skip Content-Encoding decoding and
+        # silently drop every frame if the stream ever arrives gzipped.)
+        buf = bytearray()
+        async for raw in response.aiter_bytes():
+            buf += raw
+            start = 0
+            while True:
+                nl = buf.find(b"\n", start)
+                if nl < 0:
+                    break
+                line = buf[start:nl]
+                start = nl + 1
                 if not line.strip():
                     continue
                 try:
-                    chunk = json.loads(line)
-                    yield chunk
-                except json.JSONDecodeError:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError:
                     continue
+            if start:
+                del buf[:start]
 
 
 async def chat_no_stream(
@@ -212,30 +327,26 @@ async def chat_no_stream(
     Retries on 500 errors because Qwen sometimes generates malformed tool
     call JSON that Ollama fails to parse internally.
     """
-    payload = {
-        "model": OLLAMA_MODEL,
-        "messages": messages,
-        "stream": False,
-    }
-    if include_tools:
-        payload["tools"] = TOOLS
+    body = _chat_payload(messages, stream=False, include_tools=include_tools)
 
+    client = get_http_client()
     last_error = None
     for attempt in range(1, max_retries + 1):
-        async with httpx.AsyncClient(timeout=httpx.Timeout(300.0, connect=10.0)) as client:
-            response = await client.post(
-                f"{OLLAMA_BASE_URL}/api/chat",
-                json=payload,
-            )
-            if response.status_code == 200:
-                if attempt > 1:
-                    logger.info(f"Ollama succeeded on attempt {attempt}/{max_retries}")
-                return response.json()
-
-            last_error = response.text
-            logger.warning(
-                f"Ollama returned {response.status_code} on attempt {attempt}/{max_retries}: {response.text}"
-            )
+        response = await client.post(
+            _OLLAMA_CHAT_URL,
+            content=body,
+            headers=_JSON_HEADERS,
+            timeout=_CHAT_TIMEOUT,
+        )
+        if response.status_code == 200:
+            if attempt > 1:
+                logger.info(f"Ollama succeeded on attempt {attempt}/{max_retries}")
+            return response.json()
+
+        last_error = response.text
+        logger.warning(
+            f"Ollama returned {response.status_code} on attempt {attempt}/{max_retries}: {response.text}"
+        )
 
     # All retries exhausted — fall back to a no-tools call so the user
     # still gets a response instead of an error
@@ -243,11 +354,11 @@ async def chat_no_stream(
         f"Ollama failed all {max_retries} retries with tools; "
         f"falling back to no-tools call"
     )
-    payload.pop("tools", None)
-    async with httpx.AsyncClient(timeout=httpx.Timeout(300.0, connect=10.0)) as client:
-        response = await client.post(
-            f"{OLLAMA_BASE_URL}/api/chat",
-            json=payload,
-        )
-        response.raise_for_status()
-        return response.json()
+    response = await client.post(
+        _OLLAMA_CHAT_URL,
+        content=_chat_payload(messages, stream=False, include_tools=False),
+        headers=_JSON_HEADERS,
+        timeout=_CHAT_TIMEOUT,
+    )
+    response.raise_for_status()
+    return response.json()
@@ -1,10 +1,15 @@
 import asyncio
+import hashlib
 import logging
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
 
-import httpx
 import trafilatura
 
+from http_client import get_http_client
+
 logger = logging.getLogger(__name__)
 
 SERPER_API_KEY = os.getenv("SERPER_API_KEY", "")
@@ -16,31 +21,150 @@ MAX_CONTENT_PER_PAGE = 2000
 MAX_PAGES_TO_FETCH = 3
 # Timeout for fetching individual pages
 FETCH_TIMEOUT = 10.0
+# Cap on raw HTML read per page: plenty for trafilatura to find the main
+# content, without pulling multi-megabyte pages into memory
+MAX_HTML_BYTES = 512 * 1024
+# Bodies smaller than this are redirect stubs or error shells — not worth
+# the lxml parse; the Serper snippet covers them
+MIN_HTML_BYTES = 512
+# At most this many page fetches in flight at once across all searches
+_fetch_semaphore = asyncio.Semaphore(4)
+
+_FETCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
+}
+
+# trafilatura's HTML parsing is CPU-bound — running it in threads still
+# serializes on the GIL next to the event loop. A small process pool
+# keeps extraction off the server cores that handle streaming.
+_extract_pool: ProcessPoolExecutor | None = None
+
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    global _extract_pool
+    if _extract_pool is None:
+        _extract_pool = ProcessPoolExecutor(max_workers=2)
+    return _extract_pool
+
+
+def shutdown_extract_pool():
+    global _extract_pool
+    if _extract_pool is not None:
+        _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
+
+def _canonical_url(url: str) -> str:
+    """Canonical form for dedup: fragment dropped, host lowercased."""
+    parts = urlsplit(url)
+    return parts._replace(fragment="", netloc=parts.netloc.lower()).geturl()
+
+
+# On-disk cache of extracted page text, keyed by canonical URL. Repeat
+# searches keep hitting the same top pages; a cache read is ~1 ms against
+# 1-3 s of network plus lxml parse. Entries expire after the TTL and the
+# directory is pruned to a fixed size, oldest first.
+PAGE_CACHE_DIR = os.path.join(os.path.dirname(__file__), "page_cache")
+PAGE_CACHE_TTL = 24 * 3600
+PAGE_CACHE_MAX_ENTRIES = 256
+
+
+def _page_cache_path(url: str) -> str:
+    digest = hashlib.sha256(_canonical_url(url).encode()).hexdigest()
+    return os.path.join(PAGE_CACHE_DIR, f"{digest}.txt")
+
+
+def _page_cache_get(url: str) -> str | None:
+    """Return cached extracted text for a URL, or None if absent/expired."""
+    path = _page_cache_path(url)
+    try:
+        if time.time() - os.path.getmtime(path) > PAGE_CACHE_TTL:
+            return None
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _page_cache_put(url: str, text: str):
+    """Store extracted text for a URL; failures only cost the cache hit."""
+    try:
+        os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+        path = _page_cache_path(url)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+        _page_cache_prune()
+    except OSError as e:
+        logger.debug(f"Page cache write failed for {url}: {e}")
+
+
+def _page_cache_prune():
+    entries = [e for e in os.scandir(PAGE_CACHE_DIR) if e.name.endswith(".txt")]
+    excess = len(entries) - PAGE_CACHE_MAX_ENTRIES
+    if excess <= 0:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:excess]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _extract(html: str) -> str | None:
+    """Module-level so it pickles cleanly into the extraction pool."""
+    return trafilatura.extract(
+        html,
+        include_comments=False,
+        include_tables=True,
+        no_fallback=False,
+    )
 
 
 async def _fetch_page_content(url: str) -> str | None:
-    """Fetch a URL and extract main text content using trafilatura."""
+    """Fetch a URL (streamed, byte-capped) and extract main text content.
+
+    Extracted text is served from the disk cache when fresh.
+    """
+    cached = await asyncio.to_thread(_page_cache_get, url)
+    if cached is not None:
+        logger.debug(f"Page cache hit for {url}")
+        return cached
+
     try:
-        async with httpx.AsyncClient(
-            timeout=FETCH_TIMEOUT,
-            follow_redirects=True,
-            headers={"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"},
-        ) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            html = response.text
-
-        # trafilatura is sync, run in thread pool
-        text = await asyncio.to_thread(
-            trafilatura.extract,
-            html,
-            include_comments=False,
-            include_tables=True,
-            no_fallback=False,
+        async with _fetch_semaphore:
+            client = get_http_client()
+            async with client.stream(
+                "GET", url, timeout=FETCH_TIMEOUT, headers=_FETCH_HEADERS
+            ) as response:
+                response.raise_for_status()
+                chunks = []
+                received = 0
+                async for chunk in response.aiter_bytes():
+                    chunks.append(chunk)
+                    received += len(chunk)
+                    if received >= MAX_HTML_BYTES:
+                        # Stop reading; the closing of the stream drops
+                        # the rest of the body
+                        break
+        html = b"".join(chunks).decode(
+            response.charset_encoding or "utf-8", errors="replace"
         )
 
+        if len(html) < MIN_HTML_BYTES:
+            logger.debug(f"Skipping extraction for {url}: body too small")
+            return None
+
+        # trafilatura is sync and CPU-bound, run in the process pool
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(_get_extract_pool(), _extract, html)
+
         if text and len(text.strip()) > 100:
-            return text.strip()[:MAX_CONTENT_PER_PAGE]
+            result = text.strip()[:MAX_CONTENT_PER_PAGE]
+            await asyncio.to_thread(_page_cache_put, url, result)
+            return result
         return None
     except Exception as e:
         logger.debug(f"Failed to fetch {url}: {e}")
@@ -51,66 +175,88 @@ async def web_search(query: str) -> str:
     """Search the web and return results with actual page content."""
 
     # Step 1: Get search results from Serper
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        response = await client.post(
-            SERPER_URL,
-            headers={
-                "X-API-KEY": SERPER_API_KEY,
-                "Content-Type": "application/json",
-            },
-            json={"q": query},
-        )
-        response.raise_for_status()
-        data = response.json()
+    client = get_http_client()
+    response = await client.post(
+        SERPER_URL,
+        headers={
+            "X-API-KEY": SERPER_API_KEY,
+            "Content-Type": "application/json",
+        },
+        json={"q": query},
+        timeout=15.0,
+    )
+    response.raise_for_status()
+    data = response.json()
 
     organic = data.get("organic", [])[:5]
     if not organic:
         return f"No search results found for: {query}"
 
-    # Step 2: Fetch actual page content from top results (in parallel)
-    urls_to_fetch = [r.get("link", "") for r in organic[:MAX_PAGES_TO_FETCH] if r.get("link")]
+    # Step 2: Fetch actual page content from top results (in parallel),
+    # deduplicating by canonical URL so two results pointing at the same
+    # page cost one fetch
+    urls_to_fetch: list[str] = []
+    seen_keys: set[str] = set()
+    for r in organic:
+        link = r.get("link", "")
+        if not link:
+            continue
+        key = _canonical_url(link)
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        urls_to_fetch.append(link)
+        if len(urls_to_fetch) >= MAX_PAGES_TO_FETCH:
+            break
     logger.info(f"Fetching content from {len(urls_to_fetch)} pages...")
 
     page_contents = await asyncio.gather(
         *[_fetch_page_content(url) for url in urls_to_fetch],
         return_exceptions=True,
     )
+    content_by_key = {
+        _canonical_url(url): content
+        for url, content in zip(urls_to_fetch, page_contents)
+    }
 
-    # Step 3: Build rich context for the LLM
-    lines = [f"Web search results for: {query}\n"]
+    # Step 3: Build rich context for the LLM — one preformatted block per
+    # source and a single join, instead of several appends per result
+    parts = [f"Web search results for: {query}\n"]
 
     # Include answer box if Serper provides one
     answer_box = data.get("answerBox", {})
     if answer_box:
         ab_answer = answer_box.get("answer") or answer_box.get("snippet", "")
         if ab_answer:
-            lines.append(f"DIRECT ANSWER: {ab_answer}\n")
+            parts.append(f"DIRECT ANSWER: {ab_answer}\n")
 
     # Include knowledge graph if available
     kg = data.get("knowledgeGraph", {})
     if kg:
         kg_desc = kg.get("description", "")
         if kg_desc:
-            lines.append(f"KNOWLEDGE GRAPH: {kg.get('title', '')} - {kg_desc}\n")
+            parts.append(f"KNOWLEDGE GRAPH: {kg.get('title', '')} - {kg_desc}\n")
 
     for i, result in enumerate(organic, 1):
         title = result.get("title", "No title")
         snippet = result.get("snippet", "No snippet")
         link = result.get("link", "")
-        lines.append(f"--- Source {i}: {title} ---")
-        lines.append(f"URL: {link}")
-        lines.append(f"Snippet: {snippet}")
 
-        # Add full page content if we fetched it
-        if i <= len(page_contents):
-            content = page_contents[i - 1]
-            if isinstance(content, str) and content:
-                lines.append(f"Full content:\n{content}")
-            else:
-                lines.append("(Could not extract page content)")
+        # Full page content if we fetched it (duplicate links share the
+        # single fetched copy)
+        content = content_by_key.get(_canonical_url(link)) if link else None
+        if isinstance(content, str) and content:
+            body = f"Full content:\n{content}"
+        else:
+            body = "(Could not extract page content)"
 
-        lines.append("")
+        parts.append(
+            f"--- Source {i}: {title} ---\n"
+            f"URL: {link}\n"
+            f"Snippet: {snippet}\n"
+            f"{body}\n"
+        )
 
-    result_text = "\n".join(lines)
+    result_text = "\n".join(parts)
     logger.info(f"Total search context length: {len(result_text)} chars")
     return result_text
@@ -143,6 +143,14 @@ print(f"Pi: {math.pi}")
         assert ok is False
         assert any("eval" in e for e in errors)
 
+    def test_blocked_eval_fullwidth_identifier(self):
+        # Python NFKC-normalizes identifiers at parse time, so fullwidth
+        # "ｅｖａｌ" is the eval builtin — the raw-text fast path must
+        # not let it skip the AST walk
+        ok, errors = validate_code("ｅｖａｌ('1+1')")
+        assert ok is False
+        assert any("eval" in e for e in errors)
+
     def test_blocked_compile(self):
         ok, errors = validate_code("compile('x=1', '<string>', 'exec')")
         assert ok is False
@@ -215,45 +223,45 @@ print(f"Pi: {math.pi}")
 class TestExecuteCode:
     """Tests for the subprocess-based code executor."""
 
-    def test_simple_calculation(self):
-        result = execute_code("print(2 ** 100)")
+    async def test_simple_calculation(self):
+        result = await execute_code("print(2 ** 100)")
         assert result["success"] is True
         assert "1267650600228229401496703205376" in result["stdout"]
         assert result["errors"] == []
 
-    def test_stdout_capture(self):
-        result = execute_code("for i in range(5): print(i)")
+    async def test_stdout_capture(self):
+        result = await execute_code("for i in range(5): print(i)")
         assert result["success"] is True
         assert "0\n1\n2\n3\n4" in result["stdout"]
 
-    def test_stderr_on_runtime_error(self):
-        result = execute_code("1/0")
+    async def test_stderr_on_runtime_error(self):
+        result = await execute_code("1/0")
         assert result["success"] is False
         assert "ZeroDivisionError" in result["stderr"]
 
-    def test_blocked_import_rejected(self):
-        result = execute_code("import os\nos.listdir('/')")
+    async def test_blocked_import_rejected(self):
+        result = await execute_code("import os\nos.listdir('/')")
         assert result["success"] is False
         assert len(result["errors"]) > 0
         assert result["stdout"] == ""
         assert result["execution_id"] == ""
 
-    def test_blocked_builtin_rejected(self):
-        result = execute_code("eval('1+1')")
+    async def test_blocked_builtin_rejected(self):
+        result = await execute_code("eval('1+1')")
         assert result["success"] is False
         assert any("eval" in e for e in result["errors"])
 
-    def test_execution_id_generated(self):
-        result = execute_code("print('hi')")
+    async def test_execution_id_generated(self):
+        result = await execute_code("print('hi')")
         assert result["success"] is True
         assert len(result["execution_id"]) > 0
 
-    def test_images_empty_without_plots(self):
-        result = execute_code("print('no plots')")
+    async def test_images_empty_without_plots(self):
+        result = await execute_code("print('no plots')")
         assert result["success"] is True
         assert result["images"] == []
 
-    def test_matplotlib_plot_generates_image(self):
+    async def test_matplotlib_plot_generates_image(self):
         code = """
 import matplotlib.pyplot as plt
 plt.figure()
@@ -261,7 +269,7 @@ plt.plot([1, 2, 3], [4, 5, 6])
 plt.title("Test")
 plt.show()
 """
-        result = execute_code(code)
+        result = await execute_code(code)
         assert result["success"] is True
         assert len(result["images"]) == 1
         assert result["images"][0].startswith("/api/code-output/")
@@ -278,7 +286,7 @@ plt.show()
         # Cleanup
         shutil.rmtree(os.path.join(OUTPUT_BASE_DIR, result["execution_id"]), ignore_errors=True)
 
-    def test_multiple_plots(self):
+    async def test_multiple_plots(self):
         code = """
 import matplotlib.pyplot as plt
 
@@ -290,14 +298,14 @@ plt.figure()
 plt.bar([1, 2], [5, 6])
 plt.show()
 """
-        result = execute_code(code)
+        result = await execute_code(code)
         assert result["success"] is True
         assert len(result["images"]) == 2
 
         # Cleanup
         shutil.rmtree(os.path.join(OUTPUT_BASE_DIR, result["execution_id"]), ignore_errors=True)
 
-    def test_auto_save_unsaved_figures(self):
+    async def test_auto_save_unsaved_figures(self):
         """Figures without explicit plt.show() should still be saved."""
         code = """
 import matplotlib.pyplot as plt
@@ -305,66 +313,71 @@ plt.figure()
 plt.plot([1, 2, 3], [1, 4, 9])
 # No plt.show() call
 """
-        result = execute_code(code)
+        result = await execute_code(code)
         assert result["success"] is True
         assert len(result["images"]) == 1
 
         # Cleanup
         shutil.rmtree(os.path.join(OUTPUT_BASE_DIR, result["execution_id"]), ignore_errors=True)
 
-    def test_numpy_execution(self):
+    async def test_numpy_execution(self):
         code = """
 import numpy as np
 arr = np.array([1, 2, 3, 4, 5])
 print(f"mean={arr.mean()}, std={arr.std():.4f}")
 """
-        result = execute_code(code)
+        result = await execute_code(code)
         assert result["success"] is True
         assert "mean=3.0" in result["stdout"]
 
-    def test_pandas_execution(self):
+    async def test_pandas_execution(self):
         code = """
 import pandas as pd
 df = pd.DataFrame({'a': [1, 2, 3], 'b': [4, 5, 6]})
 print(df.describe())
 """
-        result = execute_code(code)
+        result = await execute_code(code)
         assert result["success"] is True
         assert "mean" in result["stdout"]
 
-    def test_json_stdlib(self):
+    async def test_json_stdlib(self):
         code = """
 import json
 data = {"key": "value", "num": 42}
 print(json.dumps(data, sort_keys=True))
 """
-        result = execute_code(code)
+        result = await execute_code(code)
         assert result["success"] is True
         assert '"key": "value"' in result["stdout"]
 
-    def test_timeout_enforcement(self):
+    async def test_timeout_enforcement(self):
         """Code that runs too long should be killed."""
         code = """
 import time
 time.sleep(60)
 """
-        result = execute_code(code)
+        result = await execute_code(code)
         assert result["success"] is False
-        assert "timed out" in result["stderr"].lower() or "timed out" in str(result["errors"]).lower()
+        assert "timed out" in result["stderr"].lower()
+        assert any("timed out" in e.lower() for e in result["errors"])
 
-    def test_temp_dir_cleaned_up(self):
-        """The temporary working directory should be removed after execution."""
+    async def test_temp_dirs_do_not_accumulate(self):
+        """Workers reuse one persistent working directory per process, so
+        repeated executions must not grow the set of temp directories."""
         import glob
         import tempfile
 
-        before = set(glob.glob(os.path.join(tempfile.gettempdir(), "code_exec_*")))
-        execute_code("print('cleanup test')")
-        after = set(glob.glob(os.path.join(tempfile.gettempdir(), "code_exec_*")))
-        # No new temp dirs should remain
+        pattern = os.path.join(tempfile.gettempdir(), "code_worker_*")
+        # Warm up the pool so its per-worker dirs exist before the snapshot
+        await execute_code("print('warmup')")
+        before = set(glob.glob(pattern))
+        for i in range(3):
+            await execute_code(f"print('cleanup test {i}')")
+        after = set(glob.glob(pattern))
         assert after == before
 
-    def test_syntax_error_rejected(self):
-        result = execute_code("def foo(")
+    async def test_syntax_error_rejected(self):
+        result = await execute_code("def foo(")
         assert result["success"] is False
         assert any("Syntax error" in e for e in result["errors"])
 
@@ -1,39 +1,69 @@
 """Tests for FastAPI main module helpers."""
 
+import asyncio
 import json
 
-from main import _sse
+from main import _sse, _with_keepalive
 
 
 class TestSSEHelper:
 
     def test_sse_format(self):
         result = _sse({"type": "token", "content": "hello"})
-        assert result.startswith("data: ")
-        assert result.endswith("\n\n")
+        assert result.startswith(b"data: ")
+        assert result.endswith(b"\n\n")
 
     def test_sse_valid_json(self):
         result = _sse({"type": "done", "conversation_id": "abc-123"})
-        # Strip the "data: " prefix and trailing newlines
-        json_str = result[len("data: "):].strip()
+        # Strip the b"data: " prefix and trailing newlines
+        json_str = result[len(b"data: "):].strip()
         parsed = json.loads(json_str)
         assert parsed["type"] == "done"
         assert parsed["conversation_id"] == "abc-123"
 
     def test_sse_special_characters(self):
         result = _sse({"type": "token", "content": 'He said "hello" & <goodbye>'})
-        json_str = result[len("data: "):].strip()
+        json_str = result[len(b"data: "):].strip()
         parsed = json.loads(json_str)
         assert parsed["content"] == 'He said "hello" & <goodbye>'
 
     def test_sse_unicode(self):
         result = _sse({"type": "token", "content": "日本語テスト"})
-        json_str = result[len("data: "):].strip()
+        json_str = result[len(b"data: "):].strip()
         parsed = json.loads(json_str)
         assert parsed["content"] == "日本語テスト"
 
     def test_sse_empty_content(self):
         result = _sse({"type": "token", "content": ""})
-        json_str = result[len("data: "):].strip()
+        json_str = result[len(b"data: "):].strip()
         parsed = json.loads(json_str)
         assert parsed["content"] == ""
+
+
+class TestWithKeepalive:
+
+    async def test_passes_events_through(self):
+        async def stream():
+            yield b"data: one\n\n"
+            yield b"data: two\n\n"
+
+        events = [e async for e in _with_keepalive(stream())]
+        assert events == [b"data: one\n\n", b"data: two\n\n"]
+
+    async def test_closes_wrapped_stream_on_early_exit(self):
+        """A client disconnect closes the wrapper; the wrapped generator's
+        cleanup (finally blocks, i.e. message persistence) must still run."""
+        cleaned_up = asyncio.Event()
+
+        async def stream():
+            try:
+                yield b"data: one\n\n"
+                await asyncio.sleep(60)
+                yield b"data: never\n\n"
+            finally:
+                cleaned_up.set()
+
+        wrapped = _with_keepalive(stream())
+        assert await anext(wrapped) == b"data: one\n\n"
+        await wrapped.aclose()
+        assert cleaned_up.is_set()
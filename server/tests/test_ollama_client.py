@@ -6,8 +6,9 @@ from ollama_client import TOOLS, SYSTEM_PROMPT, CONTEXT_WINDOW_SIZE, _build_olla
 class TestToolDefinitions:
     """Verify tool definitions are well-formed for Ollama."""
 
-    def test_tools_is_list(self):
-        assert isinstance(TOOLS, list)
+    def test_tools_is_sequence(self):
+        # An immutable tuple: shared by every request without copying
+        assert isinstance(TOOLS, (list, tuple))
         assert len(TOOLS) == 2
 
     def test_web_search_tool_structure(self):
@@ -0,0 +1,183 @@
+"""
+Long-lived code execution worker.
+
+Spawned by the WorkerPool in code_executor.py. Pre-imports the heavy
+scientific stack once at startup (the dominant cost of a cold python3
+subprocess), then loops reading length-prefixed orjson job frames
+{code, output_dir} on stdin and writing result frames
+{stdout, stderr, success} back on stdout.
+
+The frame protocol uses a private duplicate of the original stdout fd;
+fd 1 itself is pointed at /dev/null so stray writes from user code or
+C extensions can't corrupt the protocol.
+"""
+
+import atexit
+import contextlib
+import io
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import traceback
+import warnings
+
+import orjson
+
+# Reserve the real stdout for the frame protocol, then silence fd 1 so
+# user-level writes (including from C extensions) can't interleave.
+_PROTO_OUT = os.fdopen(os.dup(sys.stdout.fileno()), "wb", buffering=0)
+_devnull = os.open(os.devnull, os.O_WRONLY)
+os.dup2(_devnull, sys.stdout.fileno())
+os.close(_devnull)
+
+_PROTO_IN = sys.stdin.buffer
+
+# Pre-import heavy libraries once so each job skips the startup cost.
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+# yfinance alone costs several hundred ms of import time on first use,
+# which used to land on whichever chat turn first asked for a stock plot
+for _mod in ("numpy", "pandas", "yfinance"):
+    try:
+        __import__(_mod)
+    except ImportError:
+        pass
+
+# The pre-imported modules are shared by every job on this worker, and
+# user code can flip process-wide option state on them (np.set_printoptions,
+# pd.set_option, matplotlib.rcParams) that would silently change the next
+# job's output. Snapshot the defaults once, restore them between jobs.
+# Best-effort: arbitrary monkeypatching of module attributes still escapes.
+_np_defaults = None
+_np = sys.modules.get("numpy")
+if _np is not None:
+    _np_defaults = _np.get_printoptions()
+_mpl_rc_defaults = None
+if plt is not None:
+    _mpl_rc_defaults = dict(matplotlib.rcParams)
+
+
+def _reset_module_options():
+    if _np_defaults is not None:
+        _np.set_printoptions(**_np_defaults)
+    if _mpl_rc_defaults is not None:
+        matplotlib.rcParams.update(_mpl_rc_defaults)
+    pd = sys.modules.get("pandas")
+    if pd is not None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            pd.reset_option("all")
+
+# One isolated working directory per worker process, created once and
+# reused for every job (jobs on a worker run sequentially). Leftover
+# files are wiped between jobs instead of paying mkdtemp + rmtree per
+# call; the whole dir goes away when the worker exits on stdin EOF.
+_WORK_DIR = tempfile.mkdtemp(prefix="code_worker_")
+atexit.register(shutil.rmtree, _WORK_DIR, ignore_errors=True)
+os.chdir(_WORK_DIR)
+
+
+def _reset_work_dir():
+    """Remove anything the previous job left in the working directory."""
+    for entry in os.scandir(_WORK_DIR):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+def _read_frame() -> dict | None:
+    """Read one length-prefixed JSON frame; None on EOF (parent gone)."""
+    header = _PROTO_IN.read(4)
+    if len(header) < 4:
+        return None
+    (length,) = struct.unpack(">I", header)
+    payload = _PROTO_IN.read(length)
+    if len(payload) < length:
+        return None
+    return orjson.loads(payload)
+
+
+def _write_frame(obj: dict):
+    payload = orjson.dumps(obj)
+    _PROTO_OUT.write(struct.pack(">I", len(payload)) + payload)
+
+
+def _patched_show_for(output_dir: str):
+    """Build a plt.show replacement that saves open figures as PNGs."""
+    counter = [0]
+
+    def _patched_show(*args, **kwargs):
+        for fig_num in plt.get_fignums():
+            fig = plt.figure(fig_num)
+            counter[0] += 1
+            path = os.path.join(output_dir, f"plot_{counter[0]}.png")
+            # bbox_inches="tight" would run an extra text-layout pass per
+            # figure just to shave margins; default bounds render faster
+            fig.savefig(path, dpi=150, facecolor="white")
+        plt.close("all")
+
+    return _patched_show
+
+
+def _run_job(job: dict) -> dict:
+    code = job["code"]
+    output_dir = job["output_dir"]
+
+    show = None
+    if plt is not None:
+        show = _patched_show_for(output_dir)
+        plt.show = show
+
+    namespace: dict = {"__name__": "__main__"}
+    stdout_buf = io.StringIO()
+    stderr_buf = io.StringIO()
+    success = True
+
+    try:
+        with contextlib.redirect_stdout(stdout_buf), contextlib.redirect_stderr(stderr_buf):
+            try:
+                exec(compile(code, "<code>", "exec"), namespace)
+                # Auto-save any figures the code forgot to plt.show()
+                if plt is not None and plt.get_fignums():
+                    show()
+            except BaseException:
+                success = False
+                traceback.print_exc(file=stderr_buf)
+    finally:
+        if plt is not None:
+            plt.close("all")
+        _reset_module_options()
+        _reset_work_dir()
+
+    return {
+        "stdout": stdout_buf.getvalue(),
+        "stderr": stderr_buf.getvalue(),
+        "success": success,
+    }
+
+
+def main():
+    while True:
+        job = _read_frame()
+        if job is None:
+            break
+        try:
+            result = _run_job(job)
+        except Exception as e:
+            result = {"stdout": "", "stderr": str(e), "success": False}
+        _write_frame(result)
+
+
+if __name__ == "__main__":
+    main()